@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the slow parts of the export, run against the real
+XML files. For example:
+
+$ python benchmark.py parse --limit 1000
+
+"""
+import os
+import re
+import time
+import random
+import shutil
+import urllib
+import httplib
+import resource
+import threading
+import argparse
+import tempfile
+import lxml.etree
+
+import parsing
+import collation
+import definitions
+import json_export
+import fulltext
+import fuzzy
+import graph
+import server
+import binary_export
+import prefix_index
+import translation_index
+from flatten import _flatten_iteratively
+from utilities import ArticleContext, clean_string, CLEANING_REPLACEMENTS
+from tests import flatten_recursively
+
+XML_PATH = '../xml/'
+
+
+def get_xml_files(limit=None):
+    files = [(XML_PATH + file) for file in os.listdir(XML_PATH)
+             if file.endswith('.xml')]
+    files.sort()
+    return files[:limit]
+
+def time_per_file(function, files):
+    """Call function on every file and return the mean time taken per
+    file, in milliseconds.
+
+    """
+    start = time.time()
+    for file in files:
+        function(file)
+    return (time.time() - start) * 1000 / len(files)
+
+def report(name, milliseconds, baseline=None):
+    line = "%-40s %8.3f ms/file" % (name, milliseconds)
+    if baseline:
+        line += "  (%.1fx)" % (baseline / milliseconds)
+    print line
+
+def parse_with_dtd(xml_file):
+    """Parse the way we used to, loading the DTD for every file."""
+    parser = lxml.etree.XMLParser(load_dtd=True, remove_comments=True)
+    return lxml.etree.parse(xml_file, parser)
+
+def benchmark_parse(files):
+    """Compare loading the DTD for every file with resolving entities
+    from a table we load once.
+
+    """
+    # load the entity table before we start timing, as it would be
+    # for every file after the first
+    parsing.get_entity_table()
+
+    before = time_per_file(parse_with_dtd, files)
+    report("parse, loading DTD per file", before)
+
+    after = time_per_file(parsing.parse_article, files)
+    report("parse, shared entity table", after, before)
+
+# the nodes the exporter flattens, with the tags it skips in them
+FLATTENED_NODES = [('kap', ['ofc', 'fnt']), ('dif', ['ekz']),
+                   ('ekz', ['fnt', 'klr', 'uzo', 'trd', 'trdgrp']),
+                   ('rim', ['aut', 'fnt']), ('trd', None), ('ref', None),
+                   ('fnt', None)]
+
+def benchmark_flatten(files):
+    """Compare the iterative flatten_node with the recursive version
+    in tests.py, checking they give the same results on every file. We
+    time flattening on its own, since clean_string is the same for
+    both.
+
+    """
+    work = []
+    for xml_file in files:
+        tree = parsing.parse_article(xml_file)
+        context = ArticleContext.from_node(tree.getroot())
+        for (tag, skip_tags) in FLATTENED_NODES:
+            for node in tree.iter(tag):
+                work.append((node, skip_tags, context))
+
+    def time_flatten(flatten):
+        start = time.time()
+        results = [flatten(node, skip_tags, context)
+                   for (node, skip_tags, context) in work]
+        return (time.time() - start, results)
+
+    (before, expected) = time_flatten(flatten_recursively)
+    (after, results) = time_flatten(_flatten_iteratively)
+
+    mismatches = sum(1 for (old, new) in zip(expected, results) if old != new)
+    print "flattened %d nodes, %d mismatches" % (len(work), mismatches)
+
+    # report per node, in microseconds
+    print "%-40s %8.3f us/node" % ("recursive", before * 1e6 / len(work))
+    print "%-40s %8.3f us/node  (%.1fx)" % ("iterative", after * 1e6 / len(work),
+                                            before / after)
+
+def benchmark_definitions(files):
+    """Time extracting the definitions of every <drv>, reporting how
+    many of the nodes in them we get through per second.
+
+    """
+    work = []
+    nodes = 0
+    for xml_file in files:
+        tree = parsing.parse_article(xml_file)
+        context = ArticleContext.from_node(tree.getroot())
+        for drv_node in tree.iter('drv'):
+            work.append((drv_node, context))
+            nodes += sum(1 for _ in drv_node.iter())
+
+    start = time.time()
+    for (drv_node, context) in work:
+        definitions.get_all_definitions(drv_node, context)
+    seconds = time.time() - start
+
+    print "extracted %d <drv>s with %d nodes" % (len(work), nodes)
+    print "%-40s %8.0f nodes/s  %8.3f ms/drv" % (
+        "get_all_definitions", nodes / seconds, seconds * 1000 / len(work))
+
+def clean_string_sequentially(string):
+    """How clean_string used to work, with a separate pass for every
+    replacement.
+
+    """
+    string = re.sub('[\n\t ]+', ' ', string)
+    for (old, new) in CLEANING_REPLACEMENTS:
+        string = string.replace(old, new)
+    return string.strip()
+
+def benchmark_clean(files):
+    """Compare clean_string with making each replacement in turn, on
+    the strings we clean when flattening every file.
+
+    """
+    strings = []
+    for xml_file in files:
+        tree = parsing.parse_article(xml_file)
+        context = ArticleContext.from_node(tree.getroot())
+        for (tag, skip_tags) in FLATTENED_NODES:
+            for node in tree.iter(tag):
+                strings.append(_flatten_iteratively(node, skip_tags, context))
+
+    def time_clean(clean):
+        start = time.time()
+        results = [clean(string) for string in strings]
+        return (time.time() - start, results)
+
+    (before, expected) = time_clean(clean_string_sequentially)
+    (after, results) = time_clean(clean_string)
+
+    mismatches = sum(1 for (old, new) in zip(expected, results) if old != new)
+    print "cleaned %d strings, %d mismatches" % (len(strings), mismatches)
+
+    print "%-40s %8.3f us/string" % ("one pass per replacement",
+                                     before * 1e6 / len(strings))
+    print "%-40s %8.3f us/string  (%.1fx)" % ("single pass",
+                                              after * 1e6 / len(strings),
+                                              before / after)
+
+def get_peak_memory():
+    """Return the peak resident set size of this process so far, in
+    megabytes.
+
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def benchmark_memory(files):
+    """Report the peak memory used by holding every entry in memory,
+    as we do before writing out the JSON.
+
+    """
+    # parse one file first, so the baseline includes lxml and the
+    # entity table
+    json_export.get_entries(files[0])
+    baseline = get_peak_memory()
+
+    start = time.time()
+    entries = json_export.get_all_entries(files)
+    seconds = time.time() - start
+
+    peak = get_peak_memory()
+    print "extracted %d entries from %d files in %.1fs" % (
+        len(entries), len(files), seconds)
+    print "%-40s %8.1f MB" % ("peak memory before extracting", baseline)
+    print "%-40s %8.1f MB" % ("peak memory with all entries", peak)
+    print "%-40s %8.1f MB" % ("used by extraction", peak - baseline)
+
+# a mix of rare words, common words and phrases
+SEARCH_QUERIES = [u'mielo', u'abelo mielo', u'"norvega matematikisto"',
+                  u'mangxi', u'estas la', u'"la abeloj"']
+
+def search_linearly(entries, query):
+    """Find the entries matching every part of this query by looking
+    at every entry, as we would have to without an index.
+
+    """
+    phrases = [u' '.join(phrase) for phrase in fulltext.parse_query(query)]
+    matches = []
+    for (word, entry) in entries.items():
+        text = u' \n '.join(u' '.join(fulltext.tokenise(text))
+                             for text in fulltext.get_texts(entry))
+        if all(re.search(r'(?<!\w)%s(?!\w)' % re.escape(phrase), text, re.UNICODE)
+               for phrase in phrases):
+            matches.append(word)
+    return matches
+
+def benchmark_search(files):
+    """Compare searching every entry's definitions with a full-text
+    index, checking they find the same entries.
+
+    """
+    entries = json_export.get_all_entries(files)
+
+    (_, index_path) = tempfile.mkstemp()
+    try:
+        start = time.time()
+        fulltext.write_out_fulltext_index(index_path, entries)
+        print "built index of %d entries in %.1fs, %.1f MB" % (
+            len(entries), time.time() - start,
+            os.path.getsize(index_path) / (1024.0 * 1024))
+
+        start = time.time()
+        index = fulltext.FullTextIndex(index_path)
+        print "loaded index in %.1f ms" % ((time.time() - start) * 1000)
+    finally:
+        os.remove(index_path)
+
+    for query in SEARCH_QUERIES:
+        start = time.time()
+        expected = search_linearly(entries, query)
+        before = time.time() - start
+
+        start = time.time()
+        results = index.search(query, limit=len(entries))
+        after = time.time() - start
+
+        same = sorted(expected) == sorted(word for (word, _) in results)
+        print "%-30s %9.1f ms %7.1f ms  (%.0fx)%s" % (
+            query.encode('utf-8'), before * 1000, after * 1000,
+            before / after, "" if same else "  MISMATCH")
+
+def misspell(word, rng):
+    """Make one of the mistakes people make when typing this word:
+    leaving off an accent, swapping two letters, missing out a letter
+    or typing one twice.
+
+    """
+    accented = [i for (i, char) in enumerate(word) if char in u'ĉĝĥĵŝŭ']
+    i = rng.randrange(len(word))
+
+    mistake = rng.choice(['accent', 'swap', 'missing', 'double'])
+    if mistake == 'accent' and accented:
+        i = rng.choice(accented)
+        return word[:i] + u'cghjsu'[u'ĉĝĥĵŝŭ'.index(word[i])] + word[i + 1:]
+    elif mistake == 'swap' and len(word) > 1:
+        i = min(i, len(word) - 2)
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    elif mistake == 'missing' and len(word) > 1:
+        return word[:i] + word[i + 1:]
+    else:
+        return word[:i] + word[i] + word[i:]
+
+def benchmark_fuzzy(files):
+    """Compare finding the words near a misspelt word with a BK-tree
+    against comparing it with every word, checking they agree.
+
+    """
+    entries = json_export.get_all_entries(files)
+    words = sorted(set(unicode(word).lower() for word in entries))
+
+    start = time.time()
+    tree = fuzzy.build_tree(words)
+    print "built tree of %d words in %.1fs" % (len(words), time.time() - start)
+
+    rng = random.Random(0)
+    queries = [misspell(word, rng) for word in rng.sample(words, 200)]
+
+    for max_distance in [1, 2]:
+        start = time.time()
+        expected = []
+        for query in queries:
+            distance_to = fuzzy.get_distance_function(query)
+            distances = [(distance_to(word), word) for word in words]
+            expected.append(sorted((distance, word) for (distance, word) in distances
+                                   if distance <= max_distance))
+        before = time.time() - start
+
+        start = time.time()
+        results = [tree.find(query, max_distance) for query in queries]
+        after = time.time() - start
+
+        mismatches = sum(1 for (old, new) in zip(expected, results) if old != new)
+        print "distance %d: %d queries, %d mismatches" % (
+            max_distance, len(queries), mismatches)
+        print "%-40s %8.3f ms/query" % ("every word", before * 1000 / len(queries))
+        print "%-40s %8.3f ms/query  (%.1fx)" % ("BK-tree", after * 1000 / len(queries),
+                                                 before / after)
+
+def benchmark_collation(files):
+    """Compare sorting the headwords alphabetically by computing each
+    word's sort key once against computing the keys in a comparison
+    function, which computes them every time two words are compared.
+
+    """
+    entries = json_export.get_all_entries(files)
+    words = list(entries)
+    random.Random(0).shuffle(words)
+
+    def compare(word, other_word):
+        return cmp(collation.get_full_sort_key(word),
+                   collation.get_full_sort_key(other_word))
+
+    start = time.time()
+    sorted(words)
+    code_points = time.time() - start
+
+    start = time.time()
+    expected = sorted(words, cmp=compare)
+    before = time.time() - start
+
+    start = time.time()
+    results = collation.sort_words(words)
+    after = time.time() - start
+
+    print "sorted %d words, %s" % (
+        len(words), "same order" if results == expected else "different order")
+    print "%-40s %8.3f us/word" % ("by code point", code_points * 1e6 / len(words))
+    print "%-40s %8.3f us/word" % ("keys in comparison function",
+                                   before * 1e6 / len(words))
+    print "%-40s %8.3f us/word  (%.1fx)" % ("precomputed keys",
+                                            after * 1e6 / len(words),
+                                            before / after)
+
+def get_server_paths(entries, rng, count):
+    """Return count request paths for the lookup server, mostly for
+    single words, with popular words asked for far more often than
+    others as they are in practice.
+
+    """
+    words = sorted(entries)
+    # a few hundred words get most of the lookups
+    popular = rng.sample(words, 300)
+    english = sorted(set(foreign_word
+                         for entry in entries.values()
+                         for definition in entry.definitions
+                         for foreign_word in definition.translations.get('en', [])))
+
+    def quote(text):
+        return urllib.quote(text.encode('utf-8'), safe='')
+
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        word = rng.choice(popular) if rng.random() < 0.8 else rng.choice(words)
+        if kind < 0.6:
+            paths.append('/word/' + quote(word))
+        elif kind < 0.7:
+            paths.append('/words?' + '&'.join(
+                    'w=' + quote(rng.choice(popular)) for _ in range(5)))
+        elif kind < 0.8:
+            paths.append('/complete?prefix=' + quote(word[:3]))
+        elif kind < 0.9 and english:
+            paths.append('/translation?lng=en&term=' + quote(rng.choice(english)))
+        else:
+            paths.append('/links?group=subnotions&depth=3&word=' + quote(word))
+    return paths
+
+def generate_load(address, paths, clients):
+    """Request every path from the server at address, split between
+    this many concurrent clients each keeping its connection open.
+    Return the latency of every request in seconds.
+
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def client(client_paths):
+        connection = httplib.HTTPConnection(*address)
+        client_latencies = []
+        for path in client_paths:
+            start = time.time()
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            client_latencies.append(time.time() - start)
+            assert response.status in (200, 404), (path, response.status)
+        connection.close()
+
+        with lock:
+            latencies.extend(client_latencies)
+
+    threads = [threading.Thread(target=client, args=(paths[i::clients],))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def get_percentile(sorted_values, percentile):
+    index = int(round(percentile / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def benchmark_server(files, clients=4, requests=4000):
+    """Run the lookup server on the exporter's files and report the
+    latency of a realistic mix of requests, without and with the
+    response cache. We also time answering the same requests without
+    HTTP, which is where the cache helps.
+
+    """
+    entries = json_export.get_all_entries(files)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        paths = {'binary': os.path.join(temp_dir, 'dictionary.bin'),
+                 'prefix_index': os.path.join(temp_dir, 'prefixes.txt'),
+                 'translation_index': os.path.join(temp_dir, 'translations'),
+                 'graph': os.path.join(temp_dir, 'graph.json')}
+        binary_export.write_out_binary(paths['binary'], entries)
+        prefix_index.write_out_prefix_index(paths['prefix_index'], entries)
+        translation_index.write_out_reverse_index(
+            paths['translation_index'],
+            translation_index.build_reverse_index(entries))
+        graph.write_out_graph(paths['graph'], entries)
+
+        request_paths = get_server_paths(entries, random.Random(0), requests)
+
+        for (name, cache_size) in [("no cache", 0), ("LRU cache", 10000)]:
+            service = server.LookupService.from_paths(cache_size=cache_size,
+                                                      **paths)
+
+            # the time spent answering, without HTTP
+            start = time.time()
+            for path in request_paths:
+                try:
+                    service.handle(path)
+                except server.NotFound:
+                    pass
+            handling = (time.time() - start) / len(request_paths)
+            lookup_server = server.LookupServer(('localhost', 0), service)
+            thread = threading.Thread(target=lookup_server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+            start = time.time()
+            latencies = sorted(generate_load(lookup_server.server_address,
+                                             request_paths, clients))
+            seconds = time.time() - start
+
+            lookup_server.shutdown()
+            lookup_server.server_close()
+
+            print "%-12s %6.0f requests/s  p50 %6.2f ms  p99 %6.2f ms  " \
+                "(handling %.3f ms)" % (
+                name, len(latencies) / seconds,
+                get_percentile(latencies, 50) * 1000,
+                get_percentile(latencies, 99) * 1000, handling * 1000)
+    finally:
+        shutil.rmtree(temp_dir)
+
+BENCHMARKS = {
+    'parse': benchmark_parse,
+    'flatten': benchmark_flatten,
+    'definitions': benchmark_definitions,
+    'clean': benchmark_clean,
+    'memory': benchmark_memory,
+    'search': benchmark_search,
+    'fuzzy': benchmark_fuzzy,
+    'collation': benchmark_collation,
+    'server': benchmark_server,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the export.")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--limit', type=int,
+                        help="only use the first LIMIT XML files")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](get_xml_files(args.limit))
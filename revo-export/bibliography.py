@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Expanding the abbreviations ReVo uses for the sources of examples
+(e.g. <bib>PIV1</bib>) into the titles of the works.
+
+The titles come from cfg/bibliogr.xml (cfg/biblist.xml is generated
+from the same data), plus a few abbreviations the articles use that
+it doesn't have.
+
+"""
+import os
+import lxml.etree
+from collections import Counter
+
+from utilities import clean_string
+
+CFG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'cfg')
+BIBLIOGR_PATH = os.path.join(CFG_PATH, 'bibliogr.xml')
+
+# abbreviations used in the articles that bibliogr.xml doesn't have
+BIBLIOGRAPHY_ABBREVIATIONS = {
+    u'Z': u'Zamenhof',
+    # This is probably a mistake meaning PIV1.
+    u'PIV': u'Plena Ilustrita Vortaro'}
+
+# loaded on first use
+_registry = None
+
+
+def load_bibliography(bibliogr_path=BIBLIOGR_PATH):
+    """Return a dict mapping every abbreviation in bibliogr.xml to the
+    title of the work.
+
+    """
+    # the titles use entities from the DTDs
+    parser = lxml.etree.XMLParser(load_dtd=True, resolve_entities=True)
+
+    titles = {}
+    tree = lxml.etree.parse(bibliogr_path, parser)
+    for vrk_node in tree.xpath('vrk'):
+        title = vrk_node.findtext('tit')
+        if title:
+            titles[unicode(vrk_node.attrib['mll'])] = unicode(title)
+
+    return titles
+
+
+class BibliographyRegistry(object):
+    """Expands abbreviations from a dict of expansions, cleaning each
+    expansion once rather than every time we see it. If we don't have
+    an abbreviation we try it ignoring case, and otherwise count it in
+    unknown (see take_unknown_abbreviations) and leave it as it is.
+
+    """
+    def __init__(self, expansions):
+        self.expansions = dict((abbreviation, clean_string(expansion))
+                               for (abbreviation, expansion) in expansions.items())
+
+        self.lowercase_expansions = {}
+        for abbreviation in sorted(self.expansions):
+            self.lowercase_expansions.setdefault(abbreviation.lower(),
+                                                 self.expansions[abbreviation])
+
+        self.unknown = Counter()
+
+    def expand(self, abbreviation):
+        expansion = self.expansions.get(abbreviation)
+        if expansion is None:
+            expansion = self.lowercase_expansions.get(abbreviation.lower())
+        if expansion is not None:
+            return expansion
+
+        self.unknown[abbreviation] += 1
+
+        # clean string to fix quotation marks and generic abbreviations
+        return clean_string(abbreviation)
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        expansions = dict(BIBLIOGRAPHY_ABBREVIATIONS)
+        expansions.update(load_bibliography())
+        _registry = BibliographyRegistry(expansions)
+    return _registry
+
+def take_unknown_abbreviations():
+    """Return a Counter of the abbreviations we've had no expansion for
+    since we were last called, and start counting again.
+
+    """
+    registry = get_registry()
+    (unknown, registry.unknown) = (registry.unknown, Counter())
+    return unknown
+
+def expand_bibliography_abbreviation(abbreviation):
+    """Replace any abbreviations used for example sources with their
+    expansions.
+
+    """
+    return get_registry().expand(abbreviation)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""A binary dictionary format for looking up words without loading
+the whole dictionary. Readers mmap the file and only decode the
+entries they're asked for, so any number of processes can share one
+copy in the page cache and opening it takes no time at all.
+
+The file is laid out as:
+
+    magic             'REVOBIN1'
+    header            number of entries, number of hash slots (uint32s)
+    key table         for each word in sorted order: the offset and
+                      length of the word and the offset of its record
+                      (uint32s)
+    hash table        for every slot, 0 if it's empty or one more than
+                      the index into the key table (uint32s)
+    words             every word, UTF-8 encoded
+    records           for every entry, the length of its record (uint32)
+                      then the record itself: Entry.get_all() as
+                      compact JSON
+
+All integers are little-endian. The hash table uses the crc32 of the
+UTF-8 word and linear probing, so a lookup normally reads one slot,
+one key table row and the record.
+
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+
+MAGIC = 'REVOBIN1'
+HEADER = struct.Struct('<II')
+KEY_ROW = struct.Struct('<III')
+SLOT = struct.Struct('<I')
+RECORD_LENGTH = struct.Struct('<I')
+
+
+def hash_word(encoded_word):
+    return zlib.crc32(encoded_word) & 0xffffffff
+
+def get_slot_count(entry_count):
+    """Return a power of two at least twice the number of entries, so
+    the hash table is at most half full.
+
+    """
+    slot_count = 1
+    while slot_count < entry_count * 2:
+        slot_count *= 2
+    return slot_count
+
+def write_out_binary(target_file, entries):
+    """Write a dict of Entries in the format described above.
+
+    We write to a temporary file and rename it, so processes that
+    have the old file mapped keep a consistent copy.
+
+    """
+    encoded_words = [word.encode('utf-8') for word in sorted(entries)]
+    slot_count = get_slot_count(len(encoded_words))
+
+    # we don't sort keys, since that stops json using its C encoder
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    records = []
+    for word in sorted(entries):
+        record = encoder.encode(entries[word].get_all())
+        records.append(RECORD_LENGTH.pack(len(record)) + record)
+
+    words_offset = (len(MAGIC) + HEADER.size + KEY_ROW.size * len(encoded_words) +
+                    SLOT.size * slot_count)
+    records_offset = words_offset + sum(len(word) for word in encoded_words)
+
+    key_table = []
+    word_offset = words_offset
+    record_offset = records_offset
+    for (encoded_word, record) in zip(encoded_words, records):
+        key_table.append(KEY_ROW.pack(word_offset, len(encoded_word), record_offset))
+        word_offset += len(encoded_word)
+        record_offset += len(record)
+
+    slots = [0] * slot_count
+    for (i, encoded_word) in enumerate(encoded_words):
+        slot = hash_word(encoded_word) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = i + 1
+
+    temp_file = target_file + '.tmp'
+    with open(temp_file, 'wb') as output_file:
+        output_file.write(MAGIC)
+        output_file.write(HEADER.pack(len(encoded_words), slot_count))
+        output_file.write(''.join(key_table))
+        output_file.write(struct.pack('<%dI' % slot_count, *slots))
+        output_file.write(''.join(encoded_words))
+        output_file.write(''.join(records))
+    os.rename(temp_file, target_file)
+
+
+class BinaryDictionary(object):
+    """Reads a file written by write_out_binary."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # the mapping stays valid after we close the file
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a binary dictionary" % path)
+
+        (self.entry_count, self.slot_count) = HEADER.unpack_from(self.data, len(MAGIC))
+        self.key_table_offset = len(MAGIC) + HEADER.size
+        self.hash_table_offset = self.key_table_offset + KEY_ROW.size * self.entry_count
+
+    def __len__(self):
+        return self.entry_count
+
+    def close(self):
+        self.data.close()
+
+    def get_key_row(self, i):
+        return KEY_ROW.unpack_from(self.data, self.key_table_offset + KEY_ROW.size * i)
+
+    def get_encoded_word(self, i):
+        (word_offset, word_length, _) = self.get_key_row(i)
+        return self.data[word_offset:word_offset + word_length]
+
+    def find(self, word):
+        """Return the index of this word in the key table, or None if
+        we don't have it.
+
+        """
+        encoded_word = word.encode('utf-8')
+        mask = self.slot_count - 1
+
+        slot = hash_word(encoded_word) & mask
+        while True:
+            (entry_number,) = SLOT.unpack_from(
+                self.data, self.hash_table_offset + SLOT.size * slot)
+            if entry_number == 0:
+                return None
+
+            if self.get_encoded_word(entry_number - 1) == encoded_word:
+                return entry_number - 1
+
+            slot = (slot + 1) & mask
+
+    def __contains__(self, word):
+        return self.find(word) is not None
+
+    def get(self, word, default=None):
+        """Return the data of this word, as Entry.get_all would give it,
+        or default if we don't have it.
+
+        """
+        i = self.find(word)
+        if i is None:
+            return default
+
+        (_, _, record_offset) = self.get_key_row(i)
+        (record_length,) = RECORD_LENGTH.unpack_from(self.data, record_offset)
+        start = record_offset + RECORD_LENGTH.size
+        return json.loads(self.data[start:start + record_length])
+
+    def words(self):
+        """Yield every word, in sorted order."""
+        for i in xrange(self.entry_count):
+            yield self.get_encoded_word(i).decode('utf-8')
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""A persistent on-disk cache of the entries extracted from each XML
+file, so a rebuild only needs to parse the articles that have changed.
+
+Every article gets its own cache file, named after the article. The
+cache file starts with a small header recording the hash of the
+article's content and the extractor version it was made with, so we
+can tell whether it's still valid without unpickling the entries.
+
+"""
+import os
+import hashlib
+import cPickle as pickle
+
+
+def get_content_hash(xml_file):
+    """Return a hex digest of the contents of this XML file."""
+    with open(xml_file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def get_files_hash(paths):
+    """Return a hex digest of the contents of all these files."""
+    files_hash = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            files_hash.update(f.read())
+    return files_hash.hexdigest()
+
+
+class EntryCache(object):
+    """A directory of pickled get_entries results, one file per
+    article. version should change whenever extraction would give
+    different results, so we never use stale entries.
+
+    max_size is the maximum total size of the cache in bytes. When
+    we're over it, limit_size removes the least recently used files.
+
+    """
+    suffix = '.pickle'
+    temp_suffix = '.pickle.tmp'
+
+    def __init__(self, directory, version, max_size=None):
+        self.directory = directory
+        self.version = version
+        self.max_size = max_size
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_cache_path(self, xml_file):
+        article_name = os.path.basename(xml_file)
+        return os.path.join(self.directory, article_name + self.suffix)
+
+    def get(self, xml_file, content_hash):
+        """Return the cached entries for this file, or None if we
+        don't have any for this content and extractor version.
+
+        """
+        cache_path = self.get_cache_path(xml_file)
+        try:
+            cache_file = open(cache_path, 'rb')
+        except IOError:
+            return None
+
+        with cache_file:
+            try:
+                header = pickle.load(cache_file)
+                if header != (self.version, content_hash):
+                    return None
+                entries = pickle.load(cache_file)
+            except (EOFError, pickle.UnpicklingError):
+                # a partially written file, e.g. we were interrupted
+                return None
+            except (AttributeError, ImportError):
+                # pickled with classes that have since moved
+                return None
+
+        # mark as recently used, so limit_size keeps it
+        os.utime(cache_path, None)
+        return entries
+
+    def set(self, xml_file, content_hash, entries):
+        """Store the entries extracted from this file."""
+        cache_path = self.get_cache_path(xml_file)
+
+        # write to a temporary file first, so a crash never leaves a
+        # truncated file with a valid header
+        temp_path = cache_path[:-len(self.suffix)] + self.temp_suffix
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump((self.version, content_hash), cache_file,
+                        pickle.HIGHEST_PROTOCOL)
+            pickle.dump(entries, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, cache_path)
+
+    def get_cache_files(self):
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith(self.suffix)]
+
+    def get_temp_files(self):
+        """Return the temporary files set was writing when it was
+        interrupted.
+
+        """
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith(self.temp_suffix)]
+
+    def prune(self, xml_files):
+        """Remove the cached entries of every article which isn't in
+        xml_files, e.g. because it has been deleted upstream, and any
+        temporary files left behind.
+
+        """
+        wanted = set(self.get_cache_path(xml_file) for xml_file in xml_files)
+
+        for cache_path in self.get_cache_files() + self.get_temp_files():
+            if cache_path not in wanted:
+                os.remove(cache_path)
+
+    def limit_size(self):
+        """Remove the least recently used files until the cache is no
+        bigger than max_size. Temporary files left behind count too.
+
+        """
+        if self.max_size is None:
+            return
+
+        cache_files = []
+        total_size = 0
+        for cache_path in self.get_cache_files() + self.get_temp_files():
+            stat = os.stat(cache_path)
+            cache_files.append((stat.st_mtime, cache_path, stat.st_size))
+            total_size += stat.st_size
+
+        # oldest first
+        cache_files.sort()
+        for (_, cache_path, size) in cache_files:
+            if total_size <= self.max_size:
+                break
+            os.remove(cache_path)
+            total_size -= size
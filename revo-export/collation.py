@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Sorting Esperanto words in alphabetical order, rather than by code
+point (which puts ĉ after z).
+
+The alphabet comes from cfg/ordigo.xml, the order ReVo uses for its
+own indexes (ordigo2.xml has the same Esperanto letters). A word's
+sort key replaces each letter with a character giving its place in
+the alphabet, ignoring case:
+
+* spaces, hyphens and other characters that aren't letters come
+  first, by code point
+* then the letters of the Esperanto alphabet, a b c ĉ d ... ŭ v z
+* then any other letters (q, w, x, y, é ...), in lower case by code
+  point
+
+Since the key of a word is the keys of its letters one after another,
+a word starts with a prefix exactly when its key starts with the
+prefix's key, so we can search sorted keys for prefixes.
+
+Keys are unicode strings, so comparing two is a single C comparison.
+Compute them once per word (as sorted does with key=) rather than in
+a comparison function.
+
+"""
+import os
+import lxml.etree
+
+CFG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'cfg')
+ORDIGO_PATH = os.path.join(CFG_PATH, 'ordigo.xml')
+
+# the characters we map letters to, from the private use area so they
+# come after everything that isn't a letter
+FIRST_LETTER_WEIGHT = 0xE100
+OTHER_LETTER_WEIGHT = u'\uf000'
+# characters that aren't letters but would come after FIRST_LETTER_WEIGHT
+LAST_NON_LETTER_WEIGHT = u'\ue0ff'
+
+# loaded on first use
+_weights = None
+
+
+def load_alphabet(ordigo_path=ORDIGO_PATH, language_code='eo'):
+    """Return the letters of this language in alphabetical order, each
+    as a string of the forms of that letter (e.g. u'ĉĈ').
+
+    """
+    # ordigo.xml has a broken character reference in another
+    # language, which we can safely skip over
+    parser = lxml.etree.XMLParser(recover=True)
+
+    tree = lxml.etree.parse(ordigo_path, parser)
+    return [unicode(letter_node.text) for letter_node in
+            tree.xpath('lingvo[@lng=$lng]/l', lng=language_code)]
+
+
+class CollationWeights(dict):
+    """Maps the code point of every character to the string it's
+    replaced with in sort keys, working out characters we haven't
+    seen before as unicode.translate asks for them.
+
+    """
+    def __init__(self, alphabet):
+        dict.__init__(self)
+        for (i, letter) in enumerate(alphabet):
+            for form in letter:
+                self[ord(form)] = unichr(FIRST_LETTER_WEIGHT + i)
+
+    def __missing__(self, code_point):
+        character = unichr(code_point)
+        if character.isalpha():
+            weight = OTHER_LETTER_WEIGHT + character.lower()
+        elif code_point < FIRST_LETTER_WEIGHT:
+            weight = character
+        else:
+            weight = LAST_NON_LETTER_WEIGHT
+
+        self[code_point] = weight
+        return weight
+
+def get_weights():
+    global _weights
+    if _weights is None:
+        _weights = CollationWeights(load_alphabet())
+    return _weights
+
+def get_sort_key(word):
+    """Return the sort key of this word, which ignores case."""
+    return unicode(word).translate(get_weights())
+
+def get_full_sort_key(word):
+    """Return a sort key which puts words in alphabetical order, and
+    words that only differ in case in code point order (so capitals
+    first).
+
+    """
+    return (get_sort_key(word), word)
+
+def sort_words(words):
+    """Return a list of these words in alphabetical order."""
+    return sorted(words, key=get_full_sort_key)
@@ -1,21 +1,83 @@
 # -*- coding: utf-8 -*-
 import re
+import json
+import hashlib
 from collections import defaultdict
 
-from utilities import clean_string
+from utilities import clean_string, intern_string
 from words import get_words_from_kap
 from flatten import flatten_node
 
+# Most definitions have no cross-references at all, so every empty
+# group of references is this one tuple rather than its own list.
+NO_REFERENCES = ()
+
 class CrossReferences(object):
+    groups = ['see', 'see_also', 'synonyms', 'antonyms', 'supernotions',
+              'subnotions',
+              'meronyms', # 'part of', e.g. branch is a meronym of tree
+              'holonyms'] # 'has these as parts' e.g. tree is a holonym of branch
+
+    # links holds a (group, cel) pair for every reference with a
+    # target, where cel is the mrk of the <drv>, <snc> or <subsnc> it
+    # refers to
+    __slots__ = groups + ['links']
+
+    # the group of each type of reference we link to
+    LINK_GROUPS = {'dif': 'see', 'vid': 'see_also', 'sin': 'synonyms',
+                   'ant': 'antonyms', 'super': 'supernotions',
+                   'sub': 'subnotions', 'prt': 'meronyms',
+                   'malprt': 'holonyms'}
+
     def __init__(self):
-        self.see = []
-        self.see_also = []
-        self.synonyms = []
-        self.antonyms = []
-        self.supernotions = []
-        self.subnotions = []
-        self.meronyms = [] # 'part of', e.g. branch is a meronym of tree
-        self.holonyms = [] # 'has these as parts' e.g. tree is a holonym of branch
+        for group in self.__slots__:
+            setattr(self, group, NO_REFERENCES)
+
+    def _append(self, group, item):
+        """Add item to this group, giving the group its own list if
+        it's still empty.
+
+        """
+        items = getattr(self, group)
+        if items is NO_REFERENCES:
+            items = []
+            setattr(self, group, items)
+        items.append(item)
+
+    def _add(self, group, reference, ref_node):
+        """Add the text of a reference to this group, and link to the
+        targets of ref_node (either a <ref> or a <refgrp> of them).
+
+        """
+        self._append(group, reference)
+
+        if ref_node.tag == 'ref':
+            ref_nodes = [ref_node]
+        else:
+            ref_nodes = ref_node.findall('ref')
+
+        for node in ref_nodes:
+            target = node.attrib.get('cel')
+            if target:
+                self._append('links', (group, target))
+
+    def add_inline_links(self, dif_node):
+        """Link to the targets of the typed references in the text of a
+        <dif>, such as 'speco de <ref tip="super">'. We only keep the
+        text of references outside the <dif>, but these are most of
+        the supernotions.
+
+        """
+        for ref_node in dif_node.iter('ref'):
+            tip = ref_node.attrib.get('tip')
+            parent = ref_node.getparent()
+            if tip is None and parent.tag == 'refgrp':
+                tip = parent.attrib.get('tip')
+
+            group = self.LINK_GROUPS.get(tip)
+            target = ref_node.attrib.get('cel')
+            if group and target:
+                self._append('links', (group, target))
 
     def is_empty(self):
         if not (self.see or self.see_also or self.synonyms or
@@ -25,38 +87,38 @@ class CrossReferences(object):
         else:
             return False
 
-    def add_reference(self, ref_node):
+    def add_reference(self, ref_node, context=None):
         # dif=difino i.e. this word is defined elsewhere
         if ref_node.attrib.get('tip') == 'dif':
-            self.see.append(flatten_node(ref_node))
+            self._add('see', flatten_node(ref_node, context=context), ref_node)
 
         # vid=vidu ankaŭ
         elif ref_node.attrib.get('tip') == 'vid':
-            self.see_also.append(flatten_node(ref_node))
+            self._add('see_also', flatten_node(ref_node, context=context), ref_node)
 
         # sin=sinonimo
         elif ref_node.attrib.get('tip') == 'sin':
-            self.synonyms.append(flatten_node(ref_node))
+            self._add('synonyms', flatten_node(ref_node, context=context), ref_node)
 
         # ant=antonimo
         elif ref_node.attrib.get('tip') == 'ant':
-            self.antonyms.append(flatten_node(ref_node))
+            self._add('antonyms', flatten_node(ref_node, context=context), ref_node)
 
         # super=supernocio
         elif ref_node.attrib.get('tip') == 'super':
-            self.supernotions.append(flatten_node(ref_node))
+            self._add('supernotions', flatten_node(ref_node, context=context), ref_node)
 
         # sub=subnocio
         elif ref_node.attrib.get('tip') == 'sub':
-            self.subnotions.append(flatten_node(ref_node))
+            self._add('subnotions', flatten_node(ref_node, context=context), ref_node)
 
         # prt=parto de
         elif ref_node.attrib.get('tip') == 'prt':
-            self.meronyms.append(flatten_node(ref_node))
+            self._add('meronyms', flatten_node(ref_node, context=context), ref_node)
 
         # malprt=malparto de, aŭ 'konsistas el'
         elif ref_node.attrib.get('tip') == 'malprt':
-            self.holonyms.append(flatten_node(ref_node))
+            self._add('holonyms', flatten_node(ref_node, context=context), ref_node)
 
         # hom=homonimo
         # (we ignore hononyms since we collect all the definitions together
@@ -79,46 +141,46 @@ class CrossReferences(object):
         else:
             assert False, "Found an unknown reference type: %s" % ref_node.attrib.get('tip')
 
-    def add_reference_group(self, refgrp_node):
+    def add_reference_group(self, refgrp_node, context=None):
         # dif=difino i.e. this word is defined elsewhere
         if refgrp_node.attrib.get('tip') == 'dif':
             for ref_node in refgrp_node.findall('ref'):
-                self.see.append(flatten_node(ref_node))
+                self._add('see', flatten_node(ref_node, context=context), ref_node)
 
         # vid=vidu ankaŭ
         elif refgrp_node.attrib.get('tip') == 'vid':
             for ref_node in refgrp_node.findall('ref'):
-                self.see_also.append(flatten_node(ref_node))
+                self._add('see_also', flatten_node(ref_node, context=context), ref_node)
 
         # sin=sinonimo
         elif refgrp_node.attrib.get('tip') == 'sin':
             for ref_node in refgrp_node.findall('ref'):
-                self.synonyms.append(flatten_node(ref_node))
+                self._add('synonyms', flatten_node(ref_node, context=context), ref_node)
 
         # ant=antonimo
         elif refgrp_node.attrib.get('tip') == 'ant':
             for ref_node in refgrp_node.findall('ref'):
-                self.antonyms.append(flatten_node(ref_node))
+                self._add('antonyms', flatten_node(ref_node, context=context), ref_node)
 
         # super=supernocio
         elif refgrp_node.attrib.get('tip') == 'super':
             for ref_node in refgrp_node.findall('ref'):
-                self.supernotions.append(flatten_node(ref_node))
+                self._add('supernotions', flatten_node(ref_node, context=context), ref_node)
 
         # sub=subnocio
         elif refgrp_node.attrib.get('tip') == 'sub':
             for ref_node in refgrp_node.findall('ref'):
-                self.subnotions.append(flatten_node(ref_node))
+                self._add('subnotions', flatten_node(ref_node, context=context), ref_node)
 
         # prt=parto de
         elif refgrp_node.attrib.get('tip') == 'prt':
             for ref_node in refgrp_node.findall('ref'):
-                self.meronyms.append(flatten_node(ref_node))
+                self._add('meronyms', flatten_node(ref_node, context=context), ref_node)
 
         # malprt=malparto de, aŭ 'konsistas el'
         elif refgrp_node.attrib.get('tip') == 'malprt':
             for ref_node in refgrp_node.findall('ref'):
-                self.holonyms.append(flatten_node(ref_node))
+                self._add('holonyms', flatten_node(ref_node, context=context), ref_node)
 
         # hom=homonimo
         # (we ignore hononyms since we collect all the definitions together
@@ -140,8 +202,13 @@ class Definition(object):
     remarks. Note we never have subsubdefinitions.
 
     """
+    __slots__ = ['primary', 'subdefinitions', 'examples', 'remarks',
+                 'translations', 'cross_references', 'mark']
+
     def __init__(self, primary_definition=None):
         self.primary = primary_definition
+        # the mrk of the <snc> or <subsnc>, if it has one
+        self.mark = None
 
         self.subdefinitions = []
         self.examples = []
@@ -150,17 +217,38 @@ class Definition(object):
         self.cross_references = CrossReferences()
 
     def __eq__(self, other):
-        if self.primary != other.primary:
-            return False
-        if self.subdefinitions != other.subdefinitions:
-            return False
-        if self.examples != other.examples:
-            return False
-        return True
+        return self.get_fingerprint() == other.get_fingerprint()
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+
+        # strings aren't interned when unpickled, so intern them again
+        self.translations = dict(
+            (intern_string(language_code), foreign_words)
+            for (language_code, foreign_words) in self.translations.items())
+
+    def get_fingerprint(self):
+        """Return a hex digest of all the data of this definition (but
+        not its mark, which is different in every file), so only
+        definitions we'd export identically have equal fingerprints.
+        This is stable between runs and processes.
+
+        """
+        content = [self.primary,
+                   [subdefinition.get_fingerprint()
+                    for subdefinition in self.subdefinitions],
+                   self.examples, self.remarks, self.translations,
+                   [getattr(self.cross_references, name)
+                    for name in CrossReferences.__slots__]]
+        return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()
+
     def is_empty(self):
         if (not self.primary and not self.subdefinitions and
             not self.examples and self.cross_references.is_empty()):
@@ -185,7 +273,19 @@ class Definition(object):
     def to_string(self):
         return self.primary
 
-def flatten_definition(dif_node):
+def get_children_by_tag(node):
+    """Return a dict mapping tags to the children of node with that
+    tag, in document order. We look at the same few tags on every
+    <drv>, <snc> and <subsnc>, so going through the children once is
+    cheaper than a findall for every tag.
+
+    """
+    children = {}
+    for child in node:
+        children.setdefault(child.tag, []).append(child)
+    return children
+
+def flatten_definition(dif_node, context=None):
     """Convert a definition node to a simple unicode string (this
     requires us to flatten it), and handle any references or
     clarifications we encounter.
@@ -201,7 +301,7 @@ def flatten_definition(dif_node):
 
     """
     # skip examples, they're dealt with elsewhere
-    definition = flatten_node(dif_node, skip_tags=['ekz'])
+    definition = flatten_node(dif_node, skip_tags=['ekz'], context=context)
 
     # if this definition has examples, it ends with a colon not a full stop
     # but since we format examples separately, replace the colon
@@ -210,12 +310,20 @@ def flatten_definition(dif_node):
 
     return definition
 
-def get_transitivity(node):
+def get_transitivity(node, children=None):
     """Return a string stating that this node represents a transitive or
     intransitive verb, if that data was found. Otherwise return None.
 
+    children is the result of get_children_by_tag on node, if we
+    already have it.
+
     """
-    for gra_node in node.findall('gra'):
+    if children is None:
+        gra_nodes = node.findall('gra')
+    else:
+        gra_nodes = children.get('gra', [])
+
+    for gra_node in gra_nodes:
         if gra_node.text in ["sensubjekta", "sensubjekte"]:
             return "(sensubjekta)"
 
@@ -230,7 +338,7 @@ def get_transitivity(node):
 
     return None
 
-def flatten_example(ekz_node):
+def flatten_example(ekz_node, context=None):
     """Get the contents of an <ekz>, discarding examples sources
     (<fnt>s). Since a series of examples are often written in the form
     'foo; bar; baz.' we also discard trailing full stops or
@@ -265,7 +373,8 @@ def flatten_example(ekz_node):
     # <uzo> indicates topic to which this examples relates
     example = flatten_node(ekz_node,
                            skip_tags=['fnt', 'klr', 'uzo', 
-                                      'trd', 'trdgrp'])
+                                      'trd', 'trdgrp'],
+                           context=context)
 
     # remove trailing semicolon/full stop due to the examples being
     # written as a series
@@ -280,12 +389,12 @@ def flatten_example(ekz_node):
 
     source = None
     # there's probably only one <fnt>, but this loop is easy and robust
-    for fnt_node in ekz_node.findall('fnt'):
-        source = flatten_node(fnt_node)
+    for fnt_node in get_children_by_tag(ekz_node).get('fnt', []):
+        source = flatten_node(fnt_node, context=context)
 
     return (example, source)
 
-def get_examples(node):
+def get_examples(node, context=None, children=None):
     """Get all examples from the children of a node. Examples tend to
     be in <dif>s, and take the following form:
 
@@ -326,19 +435,22 @@ def get_examples(node):
     (from afekt.xml)
 
     """
+    if children is None:
+        children = get_children_by_tag(node)
+
     raw_examples = []
 
     # examples tend to be on <dif>s
-    for dif_node in node.findall('dif'):
-        for ekz_node in dif_node.findall('ekz'):
-            raw_example = flatten_example(ekz_node)
+    for dif_node in children.get('dif', []):
+        for ekz_node in get_children_by_tag(dif_node).get('ekz', []):
+            raw_example = flatten_example(ekz_node, context=context)
             if raw_example:
                 raw_examples.append(raw_example)
 
     # but examples can also be on the <snc>/<subsnc> itself
     # (or even a <drv>!)
-    for ekz_node in node.findall('ekz'):
-        raw_example = flatten_example(ekz_node)
+    for ekz_node in children.get('ekz', []):
+        raw_example = flatten_example(ekz_node, context=context)
         if raw_example:
             raw_examples.append(raw_example)
 
@@ -347,98 +459,122 @@ def get_examples(node):
     examples = []
     example_string = ""
     for (example, source) in raw_examples:
-        example_string += ' ' + example
+        if example_string:
+            example_string += ' ' + example
+        else:
+            example_string = example
 
         if not example_string.endswith(','):
-            examples.append((clean_string(example_string), source))
+            # flatten_example has already cleaned each part, so there's
+            # usually nothing left to clean
+            examples.append((clean_string(example_string, skip_if_clean=True),
+                             source))
             example_string = ""
 
     if example_string != "":
         art_node = ekz_node.iterancestors('art').next()
         kap_node = art_node.iter('kap').next()
-        word = get_words_from_kap(kap_node)[0]
+        word = get_words_from_kap(kap_node, context=context)[0]
         print ("Warning: example for %r ended with comma: %r" %
                (word, clean_string(example_string)))
             
     return examples
 
-def get_translations(node):
+def get_translations(node, context=None, children=None):
     """Get all translations attached directly to this node.
 
     """
     assert node.tag in ['snc', 'subsnc', 'drv', 'subdrv']
 
+    if children is None:
+        children = get_children_by_tag(node)
+
     # a dict that defaults to empty list if that key isn't present
     translations = defaultdict(list)
 
-    for trd_node in node.findall('trd'):
-        language_code = trd_node.attrib['lng']
-        foreign_word = flatten_node(trd_node)
+    for trd_node in children.get('trd', []):
+        language_code = intern_string(trd_node.attrib['lng'])
+        foreign_word = flatten_node(trd_node, context=context)
         translations[language_code].append(foreign_word)
 
-    for trdgrp_node in node.findall('trdgrp'):
-        language_code = trdgrp_node.attrib['lng']
+    for trdgrp_node in children.get('trdgrp', []):
+        language_code = intern_string(trdgrp_node.attrib['lng'])
 
-        for trd_node in trdgrp_node.findall('trd'):
-            foreign_word = flatten_node(trd_node)
+        for trd_node in get_children_by_tag(trdgrp_node).get('trd', []):
+            foreign_word = flatten_node(trd_node, context=context)
             if foreign_word.endswith(';'):
                 foreign_word = foreign_word[:-1]
 
             translations[language_code].append(foreign_word)
 
-    return translations
+    # we don't want a defaultdict once we've finished adding to it
+    return dict(translations)
 
-def get_subdefinition(subsnc_node):
+def get_subdefinition(subsnc_node, context=None):
     """Get a Definition object representing this subdefinition, including
     any examples and/or translations present.
 
     """
     subdefinition = Definition()
+    subdefinition.mark = subsnc_node.attrib.get('mrk')
+
+    children = get_children_by_tag(subsnc_node)
 
     # either a dif or a ref to another word
-    dif_node = subsnc_node.find('dif')
-    if dif_node is not None:
-        subdefinition.primary = flatten_definition(dif_node)
+    if 'dif' in children:
+        dif_node = children['dif'][0]
+        subdefinition.primary = flatten_definition(dif_node, context=context)
+        subdefinition.cross_references.add_inline_links(dif_node)
 
     # cross-references
     for child in subsnc_node.getchildren():
         # we avoid grandchildren to make sure add_reference_group handles them
         if child.tag == 'ref':
-            subdefinition.cross_references.add_reference(child)
+            subdefinition.cross_references.add_reference(child, context=context)
         elif child.tag == 'refgrp':
-            subdefinition.cross_references.add_reference_group(child)
+            subdefinition.cross_references.add_reference_group(child,
+                                                               context=context)
 
-    subdefinition.examples = get_examples(subsnc_node)
-    subdefinition.translations = get_translations(subsnc_node)
+    subdefinition.examples = get_examples(subsnc_node, context=context,
+                                          children=children)
+    subdefinition.translations = get_translations(subsnc_node, context=context,
+                                                  children=children)
 
     return subdefinition
 
-def get_definition_notes(node):
+def get_definition_notes(node, children=None, parent_children=None):
     """Whether a word is figurative or not, and whether or not it is
     transitive are both written outside the <dif>. Here we get this
     data and return a string.
 
+    children and parent_children are the results of
+    get_children_by_tag on node and its parent, if we already have
+    them.
+
     """
     assert node.tag in ['drv', 'snc']
 
+    if children is None:
+        children = get_children_by_tag(node)
+
     notes = ''
 
     # add figurative note if present
-    uzo_node = node.find('uzo')
-    if uzo_node is not None:
+    if 'uzo' in children:
+        uzo_node = children['uzo'][0]
         if uzo_node.text.strip().lower() == 'fig':
             notes = '(figure) '
 
     # add transitivity notes if present, could be on <snc> or on <drv>
-    transitivity = get_transitivity(node)
+    transitivity = get_transitivity(node, children)
     if not transitivity:
-        transitivity = get_transitivity(node.getparent())
+        transitivity = get_transitivity(node.getparent(), parent_children)
     if transitivity:
         notes = transitivity + ' ' + notes
 
     return notes
 
-def get_definition(snc_node):
+def get_definition(snc_node, context=None, parent_children=None):
     """Build a Definition from this <snc> and add any subdefinitions if
     present, any examples if present and any remarks if present.
 
@@ -513,51 +649,63 @@ def get_definition(snc_node):
     </snc>
     (from ac.xml)
 
+    parent_children is the result of get_children_by_tag on the parent
+    of snc_node, if we already have it.
+
     """
+    children = get_children_by_tag(snc_node)
+
     # we gradually populate the Definition
     definition = Definition()
+    definition.mark = snc_node.attrib.get('mrk')
 
     # get the primary definition itself
-    for dif_node in snc_node.findall('dif'):
-        definition.primary = flatten_definition(dif_node)
+    for dif_node in children.get('dif', []):
+        definition.primary = flatten_definition(dif_node, context=context)
+        definition.cross_references.add_inline_links(dif_node)
 
     # get examples of this definition, regardless of position
-    definition.examples = get_examples(snc_node)
+    definition.examples = get_examples(snc_node, context=context,
+                                       children=children)
 
     # may have a <ref> that points to another word
-    for ref_node in snc_node.findall('ref'):
-        definition.cross_references.add_reference(ref_node)
-    for refgrp_node in snc_node.findall('refgrp'):
-        definition.cross_references.add_reference(refgrp_node)
+    for ref_node in children.get('ref', []):
+        definition.cross_references.add_reference(ref_node, context=context)
+    for refgrp_node in children.get('refgrp', []):
+        definition.cross_references.add_reference(refgrp_node, context=context)
 
     # note: may have only <subsnc>, no <dif> or <ref>
     # (e.g. sxilin.xml)
 
     # prepend any notes (transitivity etc)
-    notes = get_definition_notes(snc_node)
+    notes = get_definition_notes(snc_node, children, parent_children)
     if notes and definition.primary:
         definition.primary = notes + definition.primary
 
     # get any subdefinitions
-    for child in snc_node.findall('subsnc'):
-        definition.subdefinitions.append(get_subdefinition(child))
+    for child in children.get('subsnc', []):
+        definition.subdefinitions.append(get_subdefinition(child,
+                                                           context=context))
 
     # get any remarks
-    for rim_node in snc_node.findall('rim'):
+    for rim_node in children.get('rim', []):
         definition.remarks.append(flatten_node(rim_node,
-                                               skip_tags=['aut', 'fnt']))
+                                               skip_tags=['aut', 'fnt'],
+                                               context=context))
 
     # get all translations
-    definition.translations = get_translations(snc_node)
+    definition.translations = get_translations(snc_node, context=context,
+                                               children=children)
 
     # final sanity check: do we have *something* for this word?
     if definition.is_empty():
         kap_node = snc_node.getparent().find('kap')
-        print "Warning: no data found for %r" % (get_words_from_kap(kap_node)[0],)
+        word = get_words_from_kap(kap_node, context=context)[0]
+        print "Warning: no data found for %r" % (word,)
 
     return definition
 
-def get_definition_from_subdrvs(subdrv_nodes):
+def get_definition_from_subdrvs(subdrv_nodes, context=None):
     """For a given <subdrv>, which seems to represent a single
     definition with children, get a definition.
 
@@ -566,22 +714,26 @@ def get_definition_from_subdrvs(subdrv_nodes):
 
     definition = Definition()
 
-    subdrv_node = subdrv_nodes[0]
-    assert len(subdrv_node.findall('dif')) <= 1, "Expected at most one <dif> on a <subdrv>"
+    dif_nodes = get_children_by_tag(subdrv_nodes[0]).get('dif', [])
+    assert len(dif_nodes) <= 1, "Expected at most one <dif> on a <subdrv>"
 
-    if subdrv_node.findall('dif'):
-        definition.primary = flatten_definition(subdrv_node.findall('dif')[0])
+    if dif_nodes:
+        definition.primary = flatten_definition(dif_nodes[0], context=context)
 
     # the rest should be normal <snc>s
     for subdrv_node in subdrv_nodes:
-        for snc_node in subdrv_node.findall('snc'):
-            subdefinition = get_definition(snc_node)
-            subdefinition.translations = get_translations(subdrv_node)
+        children = get_children_by_tag(subdrv_node)
+        for snc_node in children.get('snc', []):
+            subdefinition = get_definition(snc_node, context=context,
+                                           parent_children=children)
+            subdefinition.translations = get_translations(subdrv_node,
+                                                          context=context,
+                                                          children=children)
             definition.subdefinitions.append(subdefinition)
 
     return definition
 
-def get_subdefinitions_from_subdrv(subdrv_node):
+def get_subdefinitions_from_subdrv(subdrv_node, context=None):
     """Sometimes, frustratingly, we have a <snc>s with <dif>s and
     <subsnc>s which themselves have <dif>s. We use a heuristic where
     we only use the leaf nodes of this crazy structure.
@@ -589,17 +741,20 @@ def get_subdefinitions_from_subdrv(subdrv_node):
     """
     subdefinitions = []
 
-    for snc_node in subdrv_node.findall('snc'):
-        subsenses = snc_node.findall('subsnc')
+    children = get_children_by_tag(subdrv_node)
+    for snc_node in children.get('snc', []):
+        subsenses = get_children_by_tag(snc_node).get('subsnc', [])
         if not subsenses:
-            subdefinitions.append(get_definition(snc_node))
+            subdefinitions.append(get_definition(snc_node, context=context,
+                                                 parent_children=children))
         else:
             for subsnc_node in subsenses:
-                subdefinitions.append(get_subdefinition(subsnc_node))
+                subdefinitions.append(get_subdefinition(subsnc_node,
+                                                        context=context))
 
     return subdefinitions
 
-def get_all_definitions(drv_node):
+def get_all_definitions(drv_node, context=None):
     """For a given entry (which is a single <drv> node), get all its
     definitions. I have tested this as far as possible but bugs may
     remain given the complexity and variability of the XML.
@@ -615,74 +770,105 @@ def get_all_definitions(drv_node):
     ad.xml has a load of stuff, some of which is not documented by ReVo
     akusx.xml has <ref> and no <snc> on akusxigisistino
 
+    context is the ArticleContext of the article containing this
+    <drv>, which we pass down to everything we flatten.
+
     """
     assert drv_node.tag in ['drv', 'subdrv']
 
+    # we go through the children of the <drv> once, and every function
+    # below uses them rather than searching the <drv> again
+    children = get_children_by_tag(drv_node)
+
     definitions = []
 
     # if <dif> is outside <snc>, treat <snc>s as subsenses
     # (yes, this isn't simple)
-    for dif_node in drv_node.findall('dif'):
+    for dif_node in children.get('dif', []):
         # outside a <snc> we do not have subdefinitions
-        definition_string = flatten_definition(dif_node)
-        definition_string = get_definition_notes(drv_node) + definition_string
-        definitions.append(Definition(definition_string))
+        definition_string = flatten_definition(dif_node, context=context)
+        definition_string = get_definition_notes(drv_node, children) + definition_string
+        definition = Definition(definition_string)
+        definition.cross_references.add_inline_links(dif_node)
+        definitions.append(definition)
 
     # the common case, get definitions on <snc>s
-    for snc_node in drv_node.findall('snc'):
-        definitions.append(get_definition(snc_node))
+    for snc_node in children.get('snc', []):
+        definitions.append(get_definition(snc_node, context=context,
+                                          parent_children=children))
 
     # there may just be a <ref> (normally these are inside <snc>s)
-    for ref_node in drv_node.findall('ref'):
+    for ref_node in children.get('ref', []):
         # ignore malprt which (e.g. saluti, pluralo) just comes in awkward places
         if not ref_node.attrib.get('tip') in ['malprt', 'sub']:
-            definition_string = flatten_node(ref_node)
+            definition_string = flatten_node(ref_node, context=context)
             definitions.append(Definition(definition_string))
 
     # or similarly may be just a <refgrp>
-    for refgrp_node in drv_node.findall('refgrp'):
+    for refgrp_node in children.get('refgrp', []):
         # ignore malprt which (e.g. saluti, pluralo) just comes in awkward places
         if not refgrp_node.attrib.get('tip') in ['malprt', 'sub']:
-            definition_string = flatten_node(refgrp_node)
+            definition_string = flatten_node(refgrp_node, context=context)
             definitions.append(Definition(definition_string))
 
     # get any remarks which aren't on <dif>s and assign them
     # (arbitrarily) to the first definition. This happens so rarely
     # (e.g. abdiko) that the loss of clarity is negligible.
     rim_nodes = []
-    for rim_node in drv_node.findall('rim'):
-        rim_nodes.append(flatten_node(rim_node, skip_tags=['aut', 'fnt']))
+    for rim_node in children.get('rim', []):
+        rim_nodes.append(flatten_node(rim_node, skip_tags=['aut', 'fnt'],
+                                      context=context))
 
     if rim_nodes:
         definitions[0].remarks = rim_nodes
 
     # get any examples which are just on the <drv> (rare, e.g. 'pluralo')
-    examples = get_examples(drv_node)
+    examples = get_examples(drv_node, context=context, children=children)
     if examples:
         definitions[0].examples.extend(examples)
 
     # get any translations which are just on the <drv>
-    translations = get_translations(drv_node)
+    translations = get_translations(drv_node, context=context,
+                                    children=children)
     if translations and definitions:
         definitions[0].translations.update(translations)
 
     # get any definitions which are in a subdrv:
     # if we've already started on a definition, we add to it
+    subdrv_nodes = children.get('subdrv', [])
     if definitions:
-        for subdrv_node in drv_node.findall('subdrv'):
-            subdefinitions = get_subdefinitions_from_subdrv(subdrv_node)
+        for subdrv_node in subdrv_nodes:
+            subdefinitions = get_subdefinitions_from_subdrv(subdrv_node,
+                                                            context=context)
             definitions[0].subdefinitions.extend(subdefinitions)
     else:
-        subdrv_nodes = drv_node.findall('subdrv')
         if subdrv_nodes:
-            definitions.append(get_definition_from_subdrvs(subdrv_nodes))
+            definitions.append(get_definition_from_subdrvs(subdrv_nodes,
+                                                           context=context))
 
     # remove any duplicates (happens with multiple <ref>s
     # e.g. direkt3.xml) or empty definitions (happens with example
     # only senses, such as purigi in pur.xml)
+    definitions = [definition for definition in definitions
+                   if not definition.is_empty()]
+
+    return remove_duplicate_definitions(definitions)
+
+def remove_duplicate_definitions(definitions, seen_fingerprints=None):
+    """Return the definitions which aren't equal to an earlier one, in
+    their original order. If seen_fingerprints is given, it's a set of
+    fingerprints of definitions we already have, and we add the
+    fingerprints of the definitions we return to it.
+
+    """
+    if seen_fingerprints is None:
+        seen_fingerprints = set()
+
     no_duplicates = []
     for definition in definitions:
-        if definition not in no_duplicates and not definition.is_empty():
+        fingerprint = definition.get_fingerprint()
+        if fingerprint not in seen_fingerprints:
+            seen_fingerprints.add(fingerprint)
             no_duplicates.append(definition)
     
     return no_duplicates
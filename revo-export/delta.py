@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Patches between two versions of dictionary.json, so clients can
+update their copy without downloading the whole dictionary again.
+
+A patch is a JSON object with the entries that were added, the
+entries that changed (both in full, keyed by word) and the words that
+were removed. It also has the SHA-1 of the file it applies to and of
+the file it gives, so applying it can check the result is exactly
+what a full export would have written:
+
+$ python delta.py diff old/dictionary.json dictionary.json patch.json
+$ python delta.py apply old/dictionary.json patch.json new.json
+
+json_export.py --patch PATH writes a patch from the dictionary.json
+it's replacing.
+
+"""
+import sys
+import json
+import hashlib
+import argparse
+
+from json_format import write_out_json
+
+PATCH_VERSION = 1
+
+
+class PatchError(Exception):
+    pass
+
+
+def is_compact(content):
+    """Whether this export was written with --compact."""
+    return not content.startswith('{\n')
+
+def make_patch(old_content, new_content):
+    """Return the patch that turns the export old_content into the
+    export new_content, both strings of JSON.
+
+    """
+    old = json.loads(old_content)
+    new = json.loads(new_content)
+
+    added = {}
+    modified = {}
+    for (word, entry_data) in new.items():
+        if word not in old:
+            added[word] = entry_data
+        elif old[word] != entry_data:
+            modified[word] = entry_data
+
+    removed = sorted(word for word in old if word not in new)
+
+    return {'version': PATCH_VERSION,
+            'base_sha1': hashlib.sha1(old_content).hexdigest(),
+            'result_sha1': hashlib.sha1(new_content).hexdigest(),
+            'compact': is_compact(new_content),
+            'added': added, 'modified': modified, 'removed': removed}
+
+def write_out_patch(target_file, patch):
+    with open(target_file, 'w') as output_file:
+        output_file.write(json.dumps(patch, sort_keys=True,
+                                     separators=(',', ':')))
+
+def apply_patch(old_content, patch, target_file):
+    """Apply a patch from make_patch to the export old_content,
+    writing the result to target_file. Raise PatchError if the patch
+    is for a different export, or the result isn't the export the
+    patch was made from.
+
+    """
+    if patch['version'] != PATCH_VERSION:
+        raise PatchError("unsupported patch version: %r" % patch['version'])
+    if hashlib.sha1(old_content).hexdigest() != patch['base_sha1']:
+        raise PatchError("this patch is for a different dictionary")
+
+    entries = json.loads(old_content)
+    for word in patch['removed']:
+        del entries[word]
+    entries.update(patch['added'])
+    entries.update(patch['modified'])
+
+    write_out_json(target_file, entries, patch['compact'],
+                   get_data=lambda entry_data: entry_data)
+
+    with open(target_file) as result_file:
+        result_sha1 = hashlib.sha1(result_file.read()).hexdigest()
+    if result_sha1 != patch['result_sha1']:
+        raise PatchError("the patched dictionary doesn't match the export")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Make or apply patches between versions of dictionary.json.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    diff_parser = subparsers.add_parser('diff', help="make a patch")
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    diff_parser.add_argument('patch')
+
+    apply_parser = subparsers.add_parser('apply', help="apply a patch")
+    apply_parser.add_argument('old')
+    apply_parser.add_argument('patch')
+    apply_parser.add_argument('output')
+
+    args = parser.parse_args()
+
+    with open(args.old) as old_file:
+        old_content = old_file.read()
+
+    if args.command == 'diff':
+        with open(args.new) as new_file:
+            patch = make_patch(old_content, new_file.read())
+        write_out_patch(args.patch, patch)
+        print "%d added, %d modified, %d removed" % (
+            len(patch['added']), len(patch['modified']), len(patch['removed']))
+    else:
+        with open(args.patch) as patch_file:
+            patch = json.load(patch_file)
+        try:
+            apply_patch(old_content, patch, args.output)
+        except PatchError as e:
+            sys.exit("Error: %s" % e)
+
+if __name__ == '__main__':
+    main()